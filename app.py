@@ -1,13 +1,16 @@
 #GPT說可以抓取我網站價格跟名字 2
+import math
 import os
 
-import re
-import math
 import time
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from google.cloud import vision
 from dotenv import load_dotenv
+from llm_extractor import extract_products, to_upload_response
+from quote_scraper import DEFAULT_DEADLINE, MAX_DEADLINE, get_quotation
+from retailer_config import get_config
+from vision_client import get_vision_client, setup_credentials
 
 # **載入環境變數**
 load_dotenv()
@@ -16,40 +19,50 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)
 
-# **讀取 Google Cloud API JSON 憑證**
-cred_json = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-cred_path = "/opt/render/project/.creds/google_api.json"
-
-if not cred_json:
-    raise ValueError("❌ 找不到 Google Cloud 憑證")
+# **讀取 Google Cloud API JSON 憑證 (寫成檔案，只做一次且為原子寫入；路徑可用 GOOGLE_CREDENTIALS_PATH 指定)**
+setup_credentials()
 
-# **寫入憑證 JSON 檔案**
-os.makedirs(os.path.dirname(cred_path), exist_ok=True)
-with open(cred_path, "w") as f:
-    f.write(cred_json)
-
-# **設置 GOOGLE_APPLICATION_CREDENTIALS**
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = cred_path
+# **啟動時編譯零售商設定 (retailers.toml)，設定有誤直接無法啟動；之後修改會自動重新載入**
+get_config()
 
 @app.route("/upload", methods=["POST"])
 def upload_file():
-    """上傳圖片並進行 OCR 分析"""
+    """上傳圖片並進行 OCR 分析 (可一次上傳多張，需要 LLM 的部分會合併成一次呼叫)"""
     if "file" not in request.files:
         return jsonify({"status": "error", "message": "沒有檔案"}), 400
 
-    file = request.files["file"]
-    if file.filename == "":
+    files = request.files.getlist("file")
+    if any(file.filename == "" for file in files):
         return jsonify({"status": "error", "message": "沒有選擇檔案"}), 400
 
     try:
-        result = process_image(file)
-        return jsonify(result)
+        results = process_images(files)
+        return jsonify(results[0] if len(results) == 1 else {"status": "done", "results": results})
     except Exception as e:
         return jsonify({"status": "error", "message": f"伺服器錯誤: {str(e)}"}), 500
 
-def process_image(image_file):
-    """使用 Google Cloud Vision API 進行 OCR 並提取商品名稱 & 價格"""
-    client = vision.ImageAnnotatorClient()
+@app.route("/quote", methods=["GET"])
+def quote():
+    """根據商品網址取得報價，可用 deadline 參數指定時限 (秒)"""
+    url = request.args.get("url", "")
+    if not url:
+        return jsonify({"status": "error", "message": "沒有商品網址"}), 400
+
+    try:
+        deadline = float(request.args.get("deadline", DEFAULT_DEADLINE))
+    except ValueError:
+        deadline = math.nan
+    if not math.isfinite(deadline) or deadline <= 0:
+        return jsonify({"status": "error", "message": "deadline 必須是大於 0 的秒數"}), 400
+    # 時限上限，避免呼叫端用極大的值讓請求佔住 worker
+    deadline = min(deadline, MAX_DEADLINE)
+
+    result = get_quotation(url, deadline)
+    return jsonify(result), 502 if "錯誤" in result else 200
+
+def ocr_image(image_file):
+    """使用 Google Cloud Vision API 進行 OCR，成功回傳文字，失敗回傳錯誤 dict"""
+    client = get_vision_client()
     content = image_file.read()
     if not content:
         return {"status": "error", "message": "圖片讀取失敗"}
@@ -69,55 +82,29 @@ def process_image(image_file):
     raw_text = texts[0].description  # ✅ **OCR 解析結果**
     print("\n🔍 OCR 解析結果：")
     print(raw_text)
+    return raw_text
+
+def process_images(image_files):
+    """對每張圖片進行 OCR，再批次提取商品名稱 & 價格"""
+    results = [ocr_image(image_file) for image_file in image_files]
+    raw_texts = [result for result in results if isinstance(result, str)]
+
+    # **從 OCR 文字中提取商品名稱 & 價格 (正規表示式信心不足時才交給 LLM)**
+    extracted = iter(extract_products(raw_texts))
+    for i, result in enumerate(results):
+        if isinstance(result, str):
+            extracted_data = to_upload_response(next(extracted))
+            extracted_data["ocr_text"] = result  # **✅ 確保返回完整的數據**
+            results[i] = extracted_data
+    return results
 
-    # **從 OCR 文字中提取商品名稱 & 價格**
-    extracted_data = extract_price_and_name(raw_text)
-    extracted_data["ocr_text"] = raw_text  # **✅ 確保返回完整的數據**
-    return extracted_data
+def process_image(image_file):
+    """使用 Google Cloud Vision API 進行 OCR 並提取商品名稱 & 價格"""
+    return process_images([image_file])[0]
 
 def extract_price_and_name(ocr_text):
     """從 OCR 文字中提取商品名稱 & 價格"""
-    lines = ocr_text.split("\n")
-    product_name = "未知商品"
-    price_jpy = "N/A"
-    price_twd = "N/A"
-
-    # **🔍 嘗試抓取商品名稱 (通常在頂部)**
-    for line in lines:
-        if len(line) > 5 and not re.search(r"(税込|税抜|購入|お気に入り|ポイント|送料無料|セール|カート|条件)", line):
-            if "http" not in line and "colorDisplayCode" not in line:
-                product_name = line.strip()
-                break
-
-    # **🔍 嘗試抓取價格**
-    tax_price_match = re.search(r"[¥]?\s*([\d,]+)\s*円?\s*\(税込\)", ocr_text)  # **直接含稅價格**
-    tax_rate_match = re.search(r"税率\s*(\d+)%\s*([\d,]+)円", ocr_text)  # **稅率與未稅價格**
-    base_price_match = re.search(r"([\d,]+)\s*円\s*\(税抜\)", ocr_text)  # **未稅價格**
-    tmall_price_match = re.search(r"[¥]?\s*([\d,]+)\s*円(?:\s*送料無料)?", ocr_text)  # **天貓格式**
-    yahoo_price_match = re.search(r"[¥]?\s*([\d,]+)\s*円(?:\s*\(税\s*\d+\s*円\))?", ocr_text)  # **奇摩格式**
-    uniqlo_price_match = re.search(r"¥\s*([\d,]+)", ocr_text)  # **UNIQLO 價格 (¥1290 這種格式)**
-
-    if tax_price_match:
-        price_jpy = tax_price_match.group(1).replace(",", "")  # **直接使用含稅價格**
-    elif base_price_match and tax_rate_match:
-        base_price = int(base_price_match.group(1).replace(",", ""))
-        tax_rate = int(tax_rate_match.group(1)) / 100
-        price_jpy = str(math.ceil(base_price * (1 + tax_rate)))  # **計算含稅價格**
-    elif tmall_price_match:
-        price_jpy = tmall_price_match.group(1).replace(",", "")  # **天貓格式**
-    elif yahoo_price_match:
-        price_jpy = yahoo_price_match.group(1).replace(",", "")  # **奇摩格式**
-    elif uniqlo_price_match:
-        price_jpy = uniqlo_price_match.group(1).replace(",", "")  # **UNIQLO 格式 (¥1290)**
-    if price_jpy != "N/A":
-        price_twd = str(math.ceil(int(price_jpy) * 0.35))  # **台幣換算**
-
-    return {
-        "status": "done",
-        "商品名稱": product_name,
-        "商品日幣價格 (含稅)": f"{price_jpy} 円" if price_jpy != "N/A" else "N/A",
-        "台幣報價": f"{price_twd} 元" if price_twd != "N/A" else "N/A"
-    }
+    return to_upload_response(extract_products([ocr_text])[0])
 
 
 # **啟動 Flask**
@@ -1,16 +1,14 @@
-import os
 from google.cloud import vision
 import io
 import re
 import math
-
-# 設定 Google Cloud API JSON 憑證
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "C:/Users/Jack/PycharmProjects/PythonProject/mypython-449619-947c8f434081.json"
+from retailer_config import get_config
+from vision_client import get_vision_client
 
 
 def process_image(image_path):
     """ 使用 Google Cloud Vision API 進行 OCR """
-    client = vision.ImageAnnotatorClient()
+    client = get_vision_client()
 
     with io.open(image_path, "rb") as image_file:
         content = image_file.read()
@@ -30,8 +28,9 @@ def process_image(image_path):
     print("Google Cloud Vision API 回傳的完整結果：", response)  # ✅ 確保 API 回傳內容
 
 
-    # **判斷是否來自 BicCamera 網站**
-    if "biccamera" in raw_text.lower() or "ビックカメラ" in raw_text:
+    # **判斷是否來自 BicCamera 網站 (識別字見 retailers.toml)**
+    config = get_config()
+    if config.is_ocr_site("biccamera", raw_text):
         lines = raw_text.split("\n")
 
         # **提取商品名稱**
@@ -81,7 +80,7 @@ def process_image(image_path):
                         tax_rate = int(tax_rate_match[0]) / 100
                     price_jpy = int(base_price * (1 + tax_rate)) if tax_rate > 0 else base_price
 
-        price_twd = math.ceil(price_jpy * 0.35)
+        price_twd = math.ceil(price_jpy * config.twd_rate)
 
         return {
             "status": "done",
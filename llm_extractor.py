@@ -0,0 +1,378 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from retailer_config import get_config
+
+# **OCR 文字的結構化抽取：先用正規表示式，信心不足時才批次交給 LLM**
+#
+# 抽取結果統一為 {"name": str|None, "price_jpy": int|None, "tax_included": bool|None}，
+# 依正規化後 OCR 文字的 hash 快取，同一張商品截圖不會重複呼叫 LLM。
+# 同時進來的多個請求由共用的 MicroBatcher 在短時間窗內合併成同一次 LLM 呼叫。
+
+# 正規表示式結果的信心低於此值才呼叫 LLM
+CONFIDENCE_THRESHOLD = 0.8
+# 一次 LLM 呼叫最多包含幾段 OCR 文字
+BATCH_SIZE = 8
+# 等待其他請求的文字一起送出的時間窗 (秒)，只有需要 LLM 的文字會多等這段時間
+BATCH_WINDOW = 0.05
+
+# **LLM 時限：這是 /upload 中最慢的一段，不能讓卡住的呼叫佔住請求**
+# 單次 API 呼叫的逾時秒數與重試次數 (openai 預設為 600 秒、重試 2 次)
+LLM_TIMEOUT = 10
+LLM_MAX_RETRIES = 1
+# 每個請求最多等待 LLM 結果的秒數，逾時則使用正規表示式的結果
+LLM_WAIT = 20
+CACHE_MAX = 5000
+
+# 先用便宜的模型，抽不出名稱或價格的項目再交給較強的模型 (可用 LLM_CHEAP_MODEL / LLM_STRONG_MODEL 覆寫)
+CHEAP_MODEL = "gpt-4o-mini"
+STRONG_MODEL = "gpt-4o"
+
+# **預先編譯的價格格式 (依序嘗試)**
+TAX_PRICE_RE = re.compile(r"[¥]?\s*([\d,]+)\s*円?\s*\(税込\)")  # **直接含稅價格**
+TAX_RATE_RE = re.compile(r"税率\s*(\d+)%\s*([\d,]+)円")  # **稅率與未稅價格**
+BASE_PRICE_RE = re.compile(r"([\d,]+)\s*円\s*\(税抜\)")  # **未稅價格**
+TMALL_PRICE_RE = re.compile(r"[¥]?\s*([\d,]+)\s*円(?:\s*送料無料)?")  # **天貓格式**
+YAHOO_PRICE_RE = re.compile(r"[¥]?\s*([\d,]+)\s*円(?:\s*\(税\s*\d+\s*円\))?")  # **奇摩格式**
+UNIQLO_PRICE_RE = re.compile(r"¥\s*([\d,]+)")  # **UNIQLO 價格 (¥1290 這種格式)**
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_backend = None
+_batcher = None
+_backend_lock = threading.Lock()
+
+
+def normalize_text(text):
+    """ 正規化 OCR 文字 (全形半形統一、合併空白)，作為快取鍵 """
+    text = unicodedata.normalize("NFKC", text)
+    return "\n".join(" ".join(line.split()) for line in text.splitlines() if line.strip())
+
+
+def text_hash(text):
+    """ 正規化後 OCR 文字的 SHA-256 """
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def _to_int(price_text):
+    digits = price_text.replace(",", "")
+    return int(digits) if digits.isdigit() else None
+
+
+def regex_extract(ocr_text):
+    """ 以正規表示式從 OCR 文字中抽取商品名稱 & 價格，並附上信心分數 (0~1) """
+    name = None
+    price_jpy = None
+    tax_included = None
+    price_confidence = 0.0
+
+    # **🔍 嘗試抓取商品名稱 (通常在頂部，略過的規則見 retailers.toml)**
+    config = get_config()
+    for line in ocr_text.split("\n"):
+        if config.is_product_name(line):
+            name = line.strip()
+            break
+
+    # **🔍 嘗試抓取價格 (明確標示含稅 / 未稅的格式信心較高)**
+    tax_price_match = TAX_PRICE_RE.search(ocr_text)
+    tax_rate_match = TAX_RATE_RE.search(ocr_text)
+    base_price_match = BASE_PRICE_RE.search(ocr_text)
+    tmall_price_match = TMALL_PRICE_RE.search(ocr_text)
+    yahoo_price_match = YAHOO_PRICE_RE.search(ocr_text)
+    uniqlo_price_match = UNIQLO_PRICE_RE.search(ocr_text)
+
+    if tax_price_match:
+        price_jpy, tax_included, price_confidence = _to_int(tax_price_match.group(1)), True, 0.6
+    elif base_price_match and tax_rate_match:
+        base_price = _to_int(base_price_match.group(1))
+        tax_rate = int(tax_rate_match.group(1)) / 100
+        if base_price is not None:
+            price_jpy, tax_included, price_confidence = math.ceil(base_price * (1 + tax_rate)), True, 0.6  # **計算含稅價格**
+    elif tmall_price_match:
+        price_jpy, price_confidence = _to_int(tmall_price_match.group(1)), 0.35
+    elif yahoo_price_match:
+        price_jpy, price_confidence = _to_int(yahoo_price_match.group(1)), 0.35
+    elif uniqlo_price_match:
+        price_jpy, price_confidence = _to_int(uniqlo_price_match.group(1)), 0.3
+
+    if price_jpy is None:
+        price_confidence = 0.0
+    return {
+        "name": name,
+        "price_jpy": price_jpy,
+        "tax_included": tax_included,
+        "confidence": price_confidence + (0.4 if name else 0.0),
+    }
+
+
+class LLMBackend(ABC):
+    """ LLM 抽取後端介面 """
+
+    # 結果的「解析來源」，以及是否寫入快取
+    source = "llm"
+    cache_results = True
+
+    @abstractmethod
+    def extract_batch(self, texts):
+        """ 接收多段 OCR 文字，回傳相同順序的 {"name", "price_jpy", "tax_included"} 清單 """
+
+
+class StubBackend(LLMBackend):
+    """ 本機替身：不連網路，直接回傳正規表示式的結果 (開發、測試或沒有 API Key 時使用) """
+
+    # 不是真正的 LLM 結果：另外標示來源，也不寫入快取
+    source = "stub"
+    cache_results = False
+
+    def extract_batch(self, texts):
+        return [{key: fields[key] for key in ("name", "price_jpy", "tax_included")}
+                for fields in map(regex_extract, texts)]
+
+
+SYSTEM_PROMPT = (
+    "你是一個專業的價格分析助手。使用者會提供多段編號的日本購物網站 OCR 文字，"
+    "請逐段抽取商品名稱與日圓價格，只回傳 JSON："
+    '{"items": [{"index": 0, "name": "商品名稱", "price_jpy": 1290, "tax_included": true}]}。'
+    "price_jpy 為整數日圓，頁面只有未稅價時依標示的稅率換算成含稅價；"
+    "tax_included 表示 price_jpy 是否為含稅價，無法判斷填 null；找不到的欄位填 null。"
+)
+
+
+class OpenAIBackend(LLMBackend):
+    """ OpenAI Chat Completions 後端，先用便宜模型，抽不完整的項目再交給較強的模型 """
+
+    def __init__(self, cheap_model=None, strong_model=None):
+        from openai import OpenAI
+
+        self.client = OpenAI(timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES)
+        self.cheap_model = cheap_model or os.getenv("LLM_CHEAP_MODEL", CHEAP_MODEL)
+        self.strong_model = strong_model or os.getenv("LLM_STRONG_MODEL", STRONG_MODEL)
+
+    def _call(self, model, texts):
+        content = "\n\n".join(f"[{i}]\n{text}" for i, text in enumerate(texts))
+        response = self.client.chat.completions.create(
+            model=model,
+            temperature=0,
+            response_format={"type": "json_object"},
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": content},
+            ],
+        )
+        reply = json.loads(response.choices[0].message.content)
+        items = reply.get("items") if isinstance(reply, dict) else None
+        if not isinstance(items, list):
+            raise ValueError(f"{model} 回傳的 JSON 格式不符")
+        results = [{"name": None, "price_jpy": None, "tax_included": None} for _ in texts]
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            index = item.get("index")
+            if isinstance(index, int) and 0 <= index < len(texts):
+                price = item.get("price_jpy")
+                results[index] = {
+                    "name": item.get("name") or None,
+                    "price_jpy": int(price) if isinstance(price, (int, float)) and not isinstance(price, bool) and price > 0 else None,
+                    "tax_included": item.get("tax_included") if isinstance(item.get("tax_included"), bool) else None,
+                }
+        return results
+
+    def extract_batch(self, texts):
+        results = self._call(self.cheap_model, texts)
+        retry = [i for i, fields in enumerate(results) if not fields["name"] or not fields["price_jpy"]]
+        if retry and self.strong_model and self.strong_model != self.cheap_model:
+            try:
+                retried = self._call(self.strong_model, [texts[i] for i in retry])
+            except Exception as e:
+                # 較強的模型失敗 (或回傳格式錯誤) 時保留便宜模型已抽到的結果
+                print(f"⚠️ {self.strong_model} 重試失敗，沿用 {self.cheap_model} 的結果: {e}")
+                return results
+            for i, fields in zip(retry, retried):
+                if fields["name"] and fields["price_jpy"]:
+                    results[i] = fields
+        return results
+
+
+def get_backend():
+    """ 取得共用的 LLM 後端：LLM_BACKEND=openai|stub，未指定時有 OPENAI_API_KEY 才用 OpenAI """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = os.getenv("LLM_BACKEND") or ("openai" if os.getenv("OPENAI_API_KEY") else "stub")
+                _backend = OpenAIBackend() if name == "openai" else StubBackend()
+    return _backend
+
+
+def _run_batch(backend, batch):
+    """ 以一次 extract_batch 處理 [(text, future)]，結果或例外寫入各自的 future """
+    try:
+        extracted = backend.extract_batch([text for text, _ in batch])
+        if len(extracted) != len(batch):
+            raise ValueError(f"LLM 回傳 {len(extracted)} 筆結果，預期 {len(batch)} 筆")
+    except Exception as e:
+        for _, future in batch:
+            future.set_exception(e)
+        return
+    for (_, future), fields in zip(batch, extracted):
+        future.set_result(fields)
+
+
+class MicroBatcher:
+    """ 收集各執行緒 (請求) 送來的 OCR 文字，每 window 秒或湊滿 size 段合併成一次 LLM 呼叫 """
+
+    def __init__(self, backend, window=BATCH_WINDOW, size=BATCH_SIZE):
+        self.backend = backend
+        self.window = window
+        self.size = size
+        self._lock = threading.Lock()
+        self._queue = []
+        self._generation = 0
+
+    def submit(self, text):
+        """ 加入一段文字，回傳之後可取得抽取結果的 Future """
+        future = Future()
+        batch = None
+        with self._lock:
+            self._queue.append((text, future))
+            if len(self._queue) >= self.size:
+                batch = self._take()
+            elif len(self._queue) == 1:
+                timer = threading.Timer(self.window, self._flush, args=(self._generation,))
+                timer.daemon = True
+                timer.start()
+        if batch:
+            # 湊滿一批時立即在背景呼叫，送出的請求仍只等待 LLM_WAIT 秒
+            threading.Thread(target=_run_batch, args=(self.backend, batch), daemon=True).start()
+        return future
+
+    def _take(self):
+        batch, self._queue = self._queue, []
+        self._generation += 1  # 讓這一批的計時器失效
+        return batch
+
+    def _flush(self, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            batch = self._take()
+        _run_batch(self.backend, batch)
+
+
+def get_batcher():
+    """ 取得共用的 MicroBatcher (使用 get_backend() 的後端) """
+    global _batcher
+    if _batcher is None:
+        backend = get_backend()
+        with _backend_lock:
+            if _batcher is None:
+                _batcher = MicroBatcher(backend)
+    return _batcher
+
+
+def _cache_get(key):
+    with _cache_lock:
+        fields = _cache.get(key)
+        if fields is not None:
+            _cache.move_to_end(key)
+        return fields
+
+
+def _cache_put(key, fields):
+    with _cache_lock:
+        _cache[key] = fields
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_MAX:
+            _cache.popitem(last=False)
+
+
+def extract_products(texts, backend=None, threshold=CONFIDENCE_THRESHOLD):
+    """ 從多段 OCR 文字中抽取商品欄位，回傳相同順序的清單
+
+    每個結果為 {"name", "price_jpy", "tax_included", "source"}，source 為 cache / regex / llm / stub。
+    快取未命中且正規表示式信心不足的文字才交給 LLM：未指定 backend 時送進共用的 MicroBatcher，
+    和其他請求的文字合併呼叫；指定 backend 時直接每 BATCH_SIZE 段呼叫一次。
+    LLM 失敗或超過 LLM_WAIT 秒未回應時退回正規表示式的結果 (不寫入快取)。
+    """
+    results = [None] * len(texts)
+    pending = []
+
+    for i, text in enumerate(texts):
+        key = text_hash(text)
+        cached = _cache_get(key)
+        if cached is not None:
+            results[i] = dict(cached, source="cache")
+            continue
+
+        fields = regex_extract(text)
+        confidence = fields.pop("confidence")
+        results[i] = dict(fields, source="regex")
+        if confidence >= threshold:
+            _cache_put(key, fields)
+        else:
+            pending.append((i, key))
+
+    if pending:
+        batcher = get_batcher() if backend is None else None
+        backend = batcher.backend if batcher else backend
+        if isinstance(backend, StubBackend):
+            # 本機替身的結果就是上面已算好的正規表示式結果，不必經過 micro-batcher 再算一次
+            for i, _ in pending:
+                results[i]["source"] = backend.source
+            return results
+
+        if batcher:
+            futures = [batcher.submit(texts[i]) for i, _ in pending]
+        else:
+            futures = []
+            for start in range(0, len(pending), BATCH_SIZE):
+                batch = [(texts[i], Future()) for i, _ in pending[start:start + BATCH_SIZE]]
+                _run_batch(backend, batch)
+                futures.extend(future for _, future in batch)
+
+        errors = []
+        timed_out = False
+        wait_until = time.monotonic() + LLM_WAIT
+        for (i, key), future in zip(pending, futures):
+            try:
+                fields = future.result(timeout=max(0.0, wait_until - time.monotonic()))
+            except FutureTimeoutError:
+                # 呼叫仍在背景進行 (完成後結果直接丟棄)，這個請求先使用正規表示式的結果
+                if not timed_out:
+                    timed_out = True
+                    print(f"⚠️ LLM 超過 {LLM_WAIT} 秒未回應，改用正規表示式結果")
+                continue
+            except Exception as e:
+                if e not in errors:  # 同一批的失敗只印一次
+                    errors.append(e)
+                    print(f"⚠️ LLM 抽取失敗，改用正規表示式結果: {e}")
+                continue
+            # LLM 沒抽到的欄位保留正規表示式的結果
+            merged = {field: fields.get(field) if fields.get(field) is not None else results[i][field]
+                      for field in ("name", "price_jpy", "tax_included")}
+            if backend.cache_results:
+                _cache_put(key, merged)
+            results[i] = dict(merged, source=backend.source)
+
+    return results
+
+
+def to_upload_response(fields):
+    """ 將抽取結果轉成 /upload 的回應格式 """
+    price_jpy = fields["price_jpy"]
+    return {
+        "status": "done",
+        "商品名稱": fields["name"] or "未知商品",
+        "商品日幣價格 (含稅)": f"{price_jpy} 円" if price_jpy else "N/A",
+        "台幣報價": f"{math.ceil(price_jpy * get_config().twd_rate)} 元" if price_jpy else "N/A",
+        "含稅": fields["tax_included"],
+        "解析來源": fields["source"],
+    }
@@ -0,0 +1,490 @@
+"""
+壓力測試工具：啟動本機的假零售網站與假 Google Vision OCR 服務，
+以遞增的併發數量打 Flask 服務的 /upload 與 /quote，
+回報吞吐量、延遲百分位數、worker 飽和度與每個 worker 的記憶體用量，
+用來比較 sync / gthread / gevent / waitress 等伺服器設定。
+
+用法：
+    python load_test.py --server sync --workers 4
+    python load_test.py --server gthread --workers 4 --threads 8 --concurrency 1,4,16,64
+    python load_test.py --server waitress --threads 16 --latency 0.5 --error-rate 0.05 --throttle 20
+    python load_test.py --server gevent --json gevent.json   # 需要另外安裝 gevent
+
+假零售網站以 HTTP proxy 的方式運作：Flask 服務的 HTTP_PROXY 指向它，
+報價網址使用 http://，因此爬蟲看到的仍是真實網域，依網域回傳 *_debug.html。
+cloudscraper 網站的首頁也要走 http://，因此 Flask 服務改用 harness_config() 產生的 retailers.toml。
+HTTPS_PROXY 也指向它，任何沒有假頁面的請求 (含 https 的 CONNECT) 都會被擋下並記錄，
+測試結束時若有這類請求即視為失敗，確保不會連到真正的網站。
+只能在 Linux 上量測記憶體與 CPU (讀取 /proc)。
+"""
+import argparse
+import base64
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import requests
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# **各網域對應的假頁面**
+FIXTURES = {
+    "amazon.co.jp": "amazon_debug.html",
+    "rakuten.co.jp": "rakuten_debug.html",
+    "auctions.yahoo.co.jp": "yahoo_debug.html",
+}
+
+# **沒有存檔頁面的網站 (cloudscraper) 使用的最小假頁面，首頁與商品頁相同**
+SYNTHETIC_PAGES = {
+    "biccamera.com": '<html><head><meta property="og:image" content="http://www.biccamera.com/item.jpg"></head>'
+                     '<body><h1>ビックカメラ ストレステスト商品</h1><meta itemprop="price" content="12800"></body></html>',
+    "matsukiyococokara-online.com": '<html><body><h1>マツキヨ ストレステスト商品</h1>'
+                                    '<div class="p-productdetail__price"><big>1,580</big>円(税込)</div></body></html>',
+}
+
+# **壓力測試使用的報價網址 (走 http:// 讓假網站以 proxy 攔截)**
+QUOTE_URLS = [
+    "http://www.amazon.co.jp/dp/B000000000",
+    "http://item.rakuten.co.jp/3line/f000000027/",
+    "http://page.auctions.yahoo.co.jp/jp/auction/x000000000",
+    "http://www.biccamera.com/bc/item/0000000/",
+    "http://www.matsukiyococokara-online.com/store/online/p/0000000000000",
+]
+
+# **假 OCR 服務回傳的文字**
+FAKE_OCR_TEXT = "シーバスリーガル ミズナラ 12年 700ml\n¥4,516 (税込)\n送料無料\nカートに入れる"
+
+# **上傳用的假圖片 (假 OCR 服務不會解碼)**
+FAKE_IMAGE = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 16
+
+
+class MockBehaviour:
+    """ 假服務的延遲、錯誤率與限流設定 """
+
+    def __init__(self, latency=0.2, jitter=0.1, error_rate=0.0, throttle=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle = throttle  # 每秒可處理的請求數，0 表示不限流
+        self._lock = threading.Lock()
+        self._window = 0
+        self._count = 0
+
+    def delay(self):
+        """ 模擬回應時間 """
+        time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+    def status(self):
+        """ 依限流與錯誤率決定要回傳的狀態碼 """
+        if self.throttle:
+            with self._lock:
+                window = int(time.time())
+                if window != self._window:
+                    self._window, self._count = window, 0
+                self._count += 1
+                if self._count > self.throttle:
+                    return 429
+        if random.random() < self.error_rate:
+            return 503
+        return 200
+
+
+def make_retailer_handler(behaviour):
+    """ 建立假零售網站的 handler，依請求網域回傳對應的 *_debug.html """
+    pages = {}
+    for domain, filename in FIXTURES.items():
+        with open(os.path.join(BASE_DIR, filename), "rb") as f:
+            pages[domain] = f.read()
+    for domain, html in SYNTHETIC_PAGES.items():
+        pages[domain] = html.encode("utf-8")
+
+    class RetailerHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # 沒有假頁面可回應的請求，沒被攔下時就會連到真正的網站
+        unexpected = []
+
+        def do_CONNECT(self):
+            self.unexpected.append(f"CONNECT {self.path}")
+            self.reply(403, b"https is not mocked")
+
+        def do_GET(self):
+            host = urlsplit(self.path).hostname or self.headers.get("Host", "")
+            body = next((page for domain, page in pages.items() if host.endswith(domain)), None)
+            if body is None:
+                self.unexpected.append(f"GET {self.path}")
+                return self.reply(404, b"not found")
+
+            status = behaviour.status()
+            if status == 429:
+                return self.reply(429, b"too many requests")
+            behaviour.delay()
+            if status != 200:
+                return self.reply(status, b"service unavailable")
+            self.reply(200, body, "text/html; charset=utf-8")
+
+        def reply(self, status, body, content_type="text/plain"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return RetailerHandler
+
+
+def make_vision_handler(behaviour, ocr_text=FAKE_OCR_TEXT):
+    """ 建立假 Vision API handler，模擬 REST 的 images:annotate
+
+    ocr_text 可以是固定字串，或是接收圖片內容 (bytes) 回傳文字的函式
+    """
+
+    class VisionHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            status = behaviour.status()
+            behaviour.delay()
+            if status != 200:
+                body = json.dumps({"error": {"code": status, "message": "fake vision error"}}).encode()
+            else:
+                responses = []
+                for item in payload.get("requests", [{}]):
+                    content = base64.b64decode(item.get("image", {}).get("content", ""))
+                    text = ocr_text(content) if callable(ocr_text) else ocr_text
+                    responses.append({"textAnnotations": [{"description": text}]})
+                body = json.dumps({"responses": responses}).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return VisionHandler
+
+
+class MockServer(ThreadingHTTPServer):
+    """ 假服務使用的 HTTP server """
+    daemon_threads = True
+    request_queue_size = 256  # 預設只有 5，高併發時連線會被 reset
+
+    def handle_error(self, request, client_address):
+        # 客戶端逾時放棄 (例如備援請求勝出) 時會 broken pipe，不必印出
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start_mock_server(handler):
+    """ 在背景執行緒啟動假服務，回傳 server (server.server_port 為實際埠號) """
+    server = MockServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def harness_config(path):
+    """ 複製 retailers.toml 並把 cloudscraper 首頁改成 http://，讓它也經過假零售網站，回傳檔案路徑 """
+    with open(os.path.join(BASE_DIR, "retailers.toml"), encoding="utf-8") as f:
+        text = f.read()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text.replace('home = "https://', 'home = "http://'))
+    return path
+
+
+def free_port():
+    """ 取得一個可用的本機埠號 """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def server_command(args, port):
+    """ 依伺服器種類組出啟動指令 """
+    bind = f"127.0.0.1:{port}"
+    if args.server == "waitress":
+        return [sys.executable, "-m", "waitress", f"--listen={bind}", f"--threads={args.threads}", "app:app"]
+
+    command = [sys.executable, "-m", "gunicorn", "-w", str(args.workers), "-b", bind, "--timeout", "120"]
+    if args.server == "gthread":
+        command += ["-k", "gthread", "--threads", str(args.threads)]
+    elif args.server == "gevent":
+        command += ["-k", "gevent", "--worker-connections", str(args.threads)]
+    return command + ["app:app"]
+
+
+def server_capacity(args):
+    """ 伺服器同時可處理的請求數 (計算飽和度用) """
+    if args.server == "sync":
+        return args.workers
+    if args.server == "waitress":
+        return args.threads
+    return args.workers * args.threads
+
+
+def start_app(args, retailer_port, vision_port, tmp):
+    """ 以子行程啟動 Flask 服務 (憑證與設定檔寫在 tmp 目錄)，等到可以連線後回傳 (process, base_url) """
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "HTTP_PROXY": f"http://127.0.0.1:{retailer_port}",
+        "http_proxy": f"http://127.0.0.1:{retailer_port}",
+        "HTTPS_PROXY": f"http://127.0.0.1:{retailer_port}",
+        "https_proxy": f"http://127.0.0.1:{retailer_port}",
+        "NO_PROXY": "127.0.0.1,localhost",
+        "no_proxy": "127.0.0.1,localhost",
+        "VISION_API_ENDPOINT": f"127.0.0.1:{vision_port}",
+        "GOOGLE_CREDENTIALS_PATH": os.path.join(tmp, "google_api.json"),
+        "RETAILER_CONFIG": harness_config(os.path.join(tmp, "retailers.toml")),
+    })
+    env.setdefault("GOOGLE_APPLICATION_CREDENTIALS", "{}")
+
+    process = subprocess.Popen(server_command(args, port), cwd=BASE_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.monotonic()
+    while time.monotonic() - started < 30:
+        if process.poll() is not None:
+            raise RuntimeError(f"伺服器啟動失敗，結束代碼 {process.returncode}")
+        try:
+            requests.get(f"{base_url}/quote", timeout=1)
+            return process, base_url
+        except requests.RequestException:  # worker 尚未啟動完成
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("伺服器啟動逾時")
+
+
+def read_proc(pid, name):
+    """ 讀取 /proc/<pid>/<name>，行程不存在時回傳 None """
+    try:
+        with open(f"/proc/{pid}/{name}") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def worker_pids(master_pid):
+    """ 找出 master 底下的 worker 行程，沒有子行程時 (waitress) 回傳 master 本身 """
+    children = []
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            stat = read_proc(entry, "stat")
+            if stat and int(stat.rsplit(")", 1)[1].split()[1]) == master_pid:
+                children.append(int(entry))
+    return children or [master_pid]
+
+
+def rss_mb(pid):
+    """ 行程的常駐記憶體 (MB) """
+    status = read_proc(pid, "status") or ""
+    for line in status.splitlines():
+        if line.startswith("VmRSS:"):
+            return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def cpu_seconds(pid):
+    """ 行程累計使用的 CPU 秒數 """
+    stat = read_proc(pid, "stat")
+    if not stat:
+        return 0.0
+    fields = stat.rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+class ResourceSampler(threading.Thread):
+    """ 背景取樣每個 worker 的記憶體與 CPU 使用率 """
+
+    def __init__(self, master_pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.peak_rss = {}
+        self.cpu_start = {}
+        self.cpu_end = {}
+
+    def run(self):
+        started = time.monotonic()
+        while not self.stopped.is_set():
+            for pid in worker_pids(self.master_pid):
+                self.peak_rss[pid] = max(self.peak_rss.get(pid, 0.0), rss_mb(pid))
+                self.cpu_start.setdefault(pid, cpu_seconds(pid))
+                self.cpu_end[pid] = cpu_seconds(pid)
+            self.stopped.wait(self.interval)
+        self.elapsed = time.monotonic() - started
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        cpu = [(self.cpu_end[pid] - self.cpu_start[pid]) / max(self.elapsed, 1e-6) * 100 for pid in self.cpu_end]
+        return {
+            "workers": len(self.peak_rss),
+            "rss_mb_per_worker": round(max(self.peak_rss.values(), default=0.0), 1),
+            "rss_mb_total": round(sum(self.peak_rss.values()), 1),
+            "cpu_percent_per_worker": round(max(cpu, default=0.0), 1),
+        }
+
+
+def percentile(values, p):
+    """ 取百分位數 (nearest-rank) """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(len(ordered) * p / 100) - 1)]
+
+
+def send_request(http, base_url, upload_ratio, deadline):
+    """ 隨機送出一個 /upload 或 /quote 請求，回傳 (是否成功, 狀態碼) """
+    if random.random() < upload_ratio:
+        response = http.post(f"{base_url}/upload", files={"file": ("item.png", FAKE_IMAGE, "image/png")}, timeout=60)
+        return response.status_code == 200 and response.json().get("status") == "done", response.status_code
+    params = {"url": random.choice(QUOTE_URLS), "deadline": deadline}
+    response = http.get(f"{base_url}/quote", params=params, timeout=60)
+    return response.status_code == 200, response.status_code
+
+
+def run_level(base_url, concurrency, duration, upload_ratio, deadline):
+    """ 以固定併發數量持續送請求 duration 秒，回傳每個請求的 (延遲, 是否成功, 狀態碼) """
+    results = []
+    lock = threading.Lock()
+    end = time.monotonic() + duration
+
+    def client():
+        http = requests.Session()
+        http.trust_env = False
+        while time.monotonic() < end:
+            start = time.monotonic()
+            try:
+                ok, status = send_request(http, base_url, upload_ratio, deadline)
+            except requests.RequestException:
+                ok, status = False, 0
+            with lock:
+                results.append((time.monotonic() - start, ok, status))
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def summarize(concurrency, duration, results, capacity, resources):
+    """ 整理單一併發數量的統計結果 """
+    latencies = [latency for latency, ok, _ in results if ok]
+    all_latencies = [latency for latency, _, _ in results]
+    errors = len(results) - len(latencies)
+    # Little's law：平均同時處理中的請求數 = 吞吐量 × 平均延遲
+    in_flight = len(results) / duration * (sum(all_latencies) / len(all_latencies)) if all_latencies else 0.0
+    return dict({
+        "concurrency": concurrency,
+        "requests": len(results),
+        "throughput_rps": round(len(latencies) / duration, 2),
+        "error_rate": round(errors / len(results), 4) if results else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000),
+        "p95_ms": round(percentile(latencies, 95) * 1000),
+        "p99_ms": round(percentile(latencies, 99) * 1000),
+        "saturation": round(min(in_flight, concurrency) / capacity, 2),
+    }, **resources)
+
+
+def find_knee(levels, slo_ms):
+    """ 找出服務開始撐不住的併發數量：吞吐量不再成長、錯誤率超過 1% 或 p99 超過 SLO """
+    best = 0.0
+    for level in levels:
+        if level["error_rate"] > 0.01 or level["p99_ms"] > slo_ms:
+            return level["concurrency"]
+        if best and level["throughput_rps"] < best * 1.05:
+            return level["concurrency"]
+        best = max(best, level["throughput_rps"])
+    return None
+
+
+def print_report(args, levels, knee):
+    """ 輸出表格報告 """
+    print(f"\n📊 伺服器設定：{args.server} workers={args.workers} threads={args.threads}")
+    columns = ["concurrency", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "error_rate",
+               "saturation", "workers", "rss_mb_per_worker", "cpu_percent_per_worker"]
+    print("  ".join(f"{column:>14}" for column in columns))
+    for level in levels:
+        print("  ".join(f"{level[column]:>14}" for column in columns))
+    print("\nsaturation = 平均處理中請求數 / 伺服器可同時處理數，大於 1 表示請求開始排隊")
+    if knee:
+        print(f"⚠️ 併發數量 {knee} 時開始飽和")
+    else:
+        print("✅ 測試範圍內尚未飽和")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flask 報價服務壓力測試")
+    parser.add_argument("--server", choices=["sync", "gthread", "gevent", "waitress"], default="sync")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8, help="gthread / waitress 的執行緒數，gevent 的 worker-connections")
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32", help="逗號分隔的併發數量")
+    parser.add_argument("--duration", type=float, default=15, help="每個併發數量持續的秒數")
+    parser.add_argument("--upload-ratio", type=float, default=0.5, help="/upload 請求所佔比例，其餘為 /quote")
+    parser.add_argument("--deadline", type=float, default=8, help="/quote 的報價時限 (秒)")
+    parser.add_argument("--latency", type=float, default=0.3, help="假零售網站平均回應時間 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="假零售網站回傳 503 的比例")
+    parser.add_argument("--throttle", type=int, default=0, help="假零售網站每秒可處理的請求數，超過回傳 429")
+    parser.add_argument("--vision-latency", type=float, default=0.4, help="假 OCR 服務平均回應時間 (秒)")
+    parser.add_argument("--vision-error-rate", type=float, default=0.0)
+    parser.add_argument("--slo", type=float, default=10000, help="p99 延遲上限 (毫秒)")
+    parser.add_argument("--json", help="將結果另存為 JSON 檔")
+    args = parser.parse_args()
+
+    retailer = start_mock_server(make_retailer_handler(
+        MockBehaviour(args.latency, args.jitter, args.error_rate, args.throttle)))
+    vision_api = start_mock_server(make_vision_handler(
+        MockBehaviour(args.vision_latency, args.jitter, args.vision_error_rate)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        process, base_url = start_app(args, retailer.server_port, vision_api.server_port, tmp)
+        levels = []
+        try:
+            for concurrency in [int(c) for c in args.concurrency.split(",")]:
+                print(f"🚀 併發數量 {concurrency}，持續 {args.duration:g} 秒 ...")
+                sampler = ResourceSampler(process.pid)
+                sampler.start()
+                results = run_level(base_url, concurrency, args.duration, args.upload_ratio, args.deadline)
+                levels.append(summarize(concurrency, args.duration, results, server_capacity(args), sampler.stop()))
+        finally:
+            process.terminate()
+            process.wait()
+
+    knee = find_knee(levels, args.slo)
+    print_report(args, levels, knee)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"server": args.server, "workers": args.workers, "threads": args.threads,
+                       "knee": knee, "levels": levels}, f, indent=4, ensure_ascii=False)
+    check_unexpected(retailer)
+
+
+def check_unexpected(retailer):
+    """ 有請求沒被假零售網站處理 (可能連到真正的網站) 時以非零代碼結束 """
+    unexpected = retailer.RequestHandlerClass.unexpected
+    if unexpected:
+        for request in sorted(set(unexpected))[:10]:
+            print(f"❌ 未被假網站處理的請求：{request}")
+        sys.exit(f"❌ 共 {len(unexpected)} 個請求沒有經過假零售網站")
+
+
+if __name__ == "__main__":
+    main()
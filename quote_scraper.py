@@ -1,3 +1,4 @@
+import os
 import requests
 from bs4 import BeautifulSoup
 import json
@@ -5,215 +6,339 @@ import re
 import math
 import time
 import random
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urlsplit
 import cloudscraper  # 需要安裝 `pip install cloudscraper`
+from retailer_config import compile_selectors, get_config
 
 # 設定 User-Agent 避免被擋
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36"
 }
 
-# **全局定義 session**
-session = requests.Session()
-
-def clean_price(price_text):
-    """ 清理價格字串，確保能轉換為 int """
-    price_text = re.sub(r"[^\d]", "", price_text.replace("円", "").replace(",", "").strip())
-    return int(price_text) if price_text else None
-
-### **這裡改回 01 版本的 Amazon Japan**
-def scrape_amazon_japan(url):
-    """ 爬取 Amazon Japan 商品資訊 """
-    try:
-        response = requests.get(url, headers=HEADERS, timeout=10)
-        soup = BeautifulSoup(response.text, "lxml")
+# 輕量版頁面使用的行動裝置 User-Agent
+MOBILE_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 16_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.0 Mobile/15E148 Safari/604.1"
+}
 
-        title = soup.select_one("#productTitle")
-        price = soup.select_one(".a-price .a-offscreen")
-        image = soup.select_one("#landingImage")
+# **每個執行緒各自的 session / cloudscraper**
+# requests.Session 不保證 thread-safe；gevent monkey patch 後 threading.local 即為每個 greenlet 各一份
+_local = threading.local()
 
-        price_jpy = clean_price(price.text) if price else None
-        image_url = image["src"] if image else ""
+# **每筆報價的預設總時限 (秒)**
+DEFAULT_DEADLINE = 8
+# /quote 可指定的時限上限 (秒)
+MAX_DEADLINE = DEFAULT_DEADLINE * 3
 
-        if title and price_jpy:
-            return {
-                "網站": "Amazon Japan",
-                "名稱": title.text.strip(),
-                "日幣價格": price_jpy,
-                "台幣報價": math.ceil(price_jpy * 0.35),
-                "圖片": image_url,
-                "連結": url
-            }
-        return {"錯誤": "無法獲取 Amazon 商品價格"}
-    except Exception as e:
-        return {"錯誤": f"Amazon 爬取失敗: {str(e)}"}
+# **各網站回應時間 p95 的初始值見 retailers.toml，樣本足夠後改用實測值**
+P95_MIN_SAMPLES = 20
 
-### **以下的 Rakuten、Yahoo、Bic Camera 都完全不動**
-def scrape_rakuten(url):
-    """ 爬取 Rakuten 樂天市場 商品資訊 """
-    try:
-        response = session.get(url, headers=HEADERS, timeout=30)
-        soup = BeautifulSoup(response.text, "lxml")
+# **各網站共用的價格 / JSON-LD 選擇器**
+FALLBACK_PRICE_SELECTORS = compile_selectors(["meta[itemprop='price']", "meta[property='product:price:amount']"])
+JSONLD_SELECTORS = compile_selectors(["script[type='application/ld+json']"])
 
-        title = soup.select_one(".item-name") or soup.select_one("h1") or soup.select_one("meta[property='og:title']")
-        title_text = title["content"].strip() if title and title.name == "meta" else title.text.strip() if title else "無法獲取商品名稱"
+# **cloudscraper 取得的 cookies (clearance) 會過期，超過此秒數就重新訪問首頁**
+SCRAPER_TTL = 30 * 60
 
-        price_meta = soup.select_one("meta[itemprop='price']")
-        price_jpy = clean_price(price_meta["content"]) if price_meta else None
+# **快取快照：保留最後一次成功的報價，時限內抓不到時使用**
+SNAPSHOT_TTL = 6 * 60 * 60
+SNAPSHOT_MAX = 1000
 
-        image = soup.select_one("meta[property='og:image']")
-        image_url = image["content"] if image else ""
+_hedge_pool = ThreadPoolExecutor(max_workers=int(os.getenv("HEDGE_WORKERS", 32)), thread_name_prefix="hedge")
+_latencies = {}
+_latency_lock = threading.Lock()
+_snapshots = OrderedDict()
+_snapshot_lock = threading.Lock()
 
-        if price_jpy:
-            return {
-                "網站": "Rakuten",
-                "名稱": title_text,
-                "日幣價格": price_jpy,
-                "台幣報價": math.ceil(price_jpy * 0.35),
-                "圖片": image_url,
-                "連結": url
-            }
-        return {"錯誤": "無法獲取 Rakuten 商品價格"}
-    except Exception as e:
-        return {"錯誤": f"Rakuten 爬取失敗: {str(e)}"}
+def clean_price(price_text):
+    """ 清理價格字串，確保能轉換為 int """
+    price_text = re.sub(r"[^\d]", "", price_text.replace("円", "").replace(",", "").strip())
+    return int(price_text) if price_text else None
 
-def scrape_yahoo_auction(url):
-    """ 爬取 Yahoo Auctions 商品資訊 """
+def get_session():
+    """ 取得目前執行緒專用的 requests.Session """
+    if getattr(_local, "session", None) is None:
+        _local.session = requests.Session()
+    return _local.session
+
+def get_scraper(home_url, headers, timeout):
+    """ 取得目前執行緒專用的 cloudscraper，第一次使用或超過 SCRAPER_TTL 時先訪問首頁取得 cookies """
+    scrapers = _local.__dict__.setdefault("scrapers", {})
+    entry = scrapers.get(home_url)
+    if entry is None or time.monotonic() - entry[1] > SCRAPER_TTL:
+        scraper = cloudscraper.create_scraper(browser={'browser': 'chrome', 'platform': 'windows', 'mobile': False})
+        scraper.get(home_url, headers=headers, timeout=timeout)
+        entry = scrapers[home_url] = (scraper, time.monotonic())
+    return entry[0]
+
+def drop_scraper(home_url):
+    """ 丟棄目前執行緒的 cloudscraper (被擋或 cookies 失效時)，下次重新取得 cookies """
+    _local.__dict__.get("scrapers", {}).pop(home_url, None)
+
+def time_left(deadline):
+    """ 距離時限還剩幾秒，沒有時限時回傳 None """
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+def record_latency(site, seconds):
+    """ 記錄網站回應時間，供計算 p95 使用 """
+    with _latency_lock:
+        _latencies.setdefault(site, deque(maxlen=200)).append(seconds)
+
+def site_p95(retailer):
+    """ 網站回應時間的 p95，樣本不足時使用設定檔中的值 """
+    with _latency_lock:
+        samples = sorted(_latencies.get(retailer.key, ()))
+    if len(samples) < P95_MIN_SAMPLES:
+        return retailer.p95
+    return samples[math.ceil(len(samples) * 0.95) - 1]
+
+def hedged_get(retailer, fetch, deadline=None, prepare=None):
+    """ 發送請求，超過網站 p95 仍未回應就再送一次備援請求，採用先回來的結果
+
+    fetch 接收單次請求的 timeout 並回傳 response；deadline 為 time.monotonic() 的絕對時間，
+    沒有時限時以設定檔的 timeout 為上限。prepare (同樣接收 timeout) 在同一執行緒中於 fetch 前執行，
+    不計入回應時間 (例如 cloudscraper 訪問首頁取得 cookies)。
+    """
+    site = retailer.key
+    remaining = time_left(deadline)
+    if remaining is None:
+        remaining = retailer.timeout
+    if remaining <= 0:
+        raise TimeoutError("已超過報價時限")
+    end = time.monotonic() + remaining
+
+    def timed_fetch():
+        if prepare is not None:
+            prepare(max(0.1, end - time.monotonic()))
+        start = time.monotonic()
+        response = fetch(max(0.1, end - time.monotonic()))
+        record_latency(site, time.monotonic() - start)
+        return response
+
+    pending = {_hedge_pool.submit(timed_fetch)}
     try:
-        response = requests.get(url, headers=HEADERS, timeout=10)
-        soup = BeautifulSoup(response.text, "lxml")
-
-        title = soup.select_one(".Product__title") or soup.select_one(".ProductTitle__text")
-        bid_price = soup.select_one(".Price__value")
-        buy_price = soup.select_one(".Price__now") or soup.select_one(".ProductPrice__value")
-        auction_time = soup.select_one(".Auction__endTime")
-
-        price_jpy = None
-        price_text = None
-
-        if buy_price:
-            price_text = buy_price.text.strip()
-        elif bid_price:
-            price_text = bid_price.text.strip()
-
-        if price_text:
-            price_text = re.sub(r"税\s*\d*\s*円", "", price_text)
-            price_jpy = clean_price(price_text)
-
-        image = soup.select_one("meta[property='og:image']")
-        image_url = image["content"] if image else ""
-
-        if title and price_jpy:
-            return {
-                "網站": "Yahoo Auctions",
-                "名稱": title.text.strip(),
-                "日幣價格": price_jpy,
-                "台幣報價": math.ceil(price_jpy * 0.35),
-                "競標結束時間": auction_time.text.strip() if auction_time else "無法取得",
-                "圖片": image_url,
-                "連結": url
-            }
-        return {"錯誤": "無法獲取 Yahoo Auctions 價格"}
-    except Exception as e:
-        return {"錯誤": f"Yahoo Auctions 爬取失敗: {str(e)}"}
-
+        # p95 已超過剩餘時間時，備援請求也來不及回來，只會多占一條連線
+        p95 = site_p95(retailer)
+        if p95 < remaining:
+            done, _ = wait(pending, timeout=p95)
+            if not done:
+                pending.add(_hedge_pool.submit(timed_fetch))
+
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, end - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+
+        if error is not None and not pending:
+            raise error
+        raise TimeoutError("已超過報價時限")
+    finally:
+        # 呼叫端已放棄時，取消還在排隊的請求，避免執行緒池塞滿沒人要的請求
+        for future in pending:
+            future.cancel()
+
+def select_text(soup, selectors):
+    """ 依序嘗試多個 (已編譯的) 選擇器，回傳第一個有內容的文字 (meta 標籤取 content) """
+    for selector in selectors:
+        for node in selector.select(soup):
+            text = node.get("content", "") if node.name == "meta" else node.text
+            if text.strip():
+                return text.strip()
+    return None
+
+def jsonld_price(soup):
+    """ 從 JSON-LD 結構化資料中找出商品價格 """
+    for script in JSONLD_SELECTORS[0].select(soup):
+        try:
+            stack = [json.loads(script.string or "")]
+        except ValueError:
+            continue
+        while stack:
+            item = stack.pop()
+            if isinstance(item, list):
+                stack.extend(item)
+            elif isinstance(item, dict):
+                price = item.get("price") or item.get("lowPrice")
+                if isinstance(price, (int, float, str)):
+                    price_jpy = clean_price(str(price).split(".")[0])
+                    if price_jpy:
+                        return price_jpy
+                stack.extend(value for value in item.values() if isinstance(value, (list, dict)))
+    return None
+
+def fallback_price(soup):
+    """ 主要選擇器找不到價格時，改從 meta 標籤與 JSON-LD 取得 """
+    price_text = select_text(soup, FALLBACK_PRICE_SELECTORS)
+    return (clean_price(price_text.split(".")[0]) if price_text else None) or jsonld_price(soup)
+
+def select_image(soup, selectors):
+    """ 依序嘗試多個選擇器，回傳第一個圖片網址 (meta 標籤取 content，其他取 src) """
+    for selector in selectors:
+        for node in selector.select(soup):
+            image_url = node.get("content" if node.name == "meta" else "src", "")
+            if image_url:
+                return image_url
+    return ""
+
+def light_variant(retailer, url):
+    """ 較輕量的行動版頁面網址 (設定 light_pattern 的網站改寫網址，其他網站使用原網址搭配行動版 User-Agent) """
+    if retailer.light_pattern:
+        match = retailer.light_pattern.search(url)
+        return retailer.light_url.format(*match.groups(), scheme=urlsplit(url).scheme or "https") if match else None
+    return url
+
+def save_snapshot(url, result):
+    """ 保存成功的報價作為快照，並標記為即時資料 """
+    with _snapshot_lock:
+        _snapshots[url] = (time.time(), dict(result))
+        _snapshots.move_to_end(url)
+        while len(_snapshots) > SNAPSHOT_MAX:
+            _snapshots.popitem(last=False)
+    result["資料新鮮度"] = "即時"
+    return result
+
+def load_snapshot(url):
+    """ 取得未過期的快照報價，並標記為快取資料與其秒數 """
+    with _snapshot_lock:
+        snapshot = _snapshots.get(url)
+    if not snapshot:
+        return None
+    saved_at, result = snapshot
+    age = time.time() - saved_at
+    if age > SNAPSHOT_TTL:
+        return None
+    result = dict(result)
+    result["資料新鮮度"] = "快取"
+    result["快取秒數"] = int(age)
+    return result
+
+def fetch_page(retailer, url, deadline, headers):
+    """ 依設定抓取頁面 (一般 session 或 cloudscraper)，回傳 response """
+    prepare = None
+    if retailer.fetcher == "cloudscraper":
+        def prepare(timeout):
+            # 使用 cloudscraper 繞過防爬，先訪問首頁取得 cookies (每個執行緒在 SCRAPER_TTL 內只需一次)
+            get_scraper(retailer.home, headers, min(timeout, 10))
+
+        def fetch(timeout):
+            # 使用 prepare 剛在這個執行緒準備好的 cloudscraper (不再檢查 TTL，避免重複訪問首頁)
+            scraper = _local.scrapers[retailer.home][0]
+            try:
+                response = scraper.get(url, headers=headers, timeout=timeout, allow_redirects=True)
+            except Exception:
+                drop_scraper(retailer.home)
+                raise
+            if response.status_code != 200:
+                # 403 挑戰頁或 cookies 失效時，下次改用新的 cloudscraper
+                drop_scraper(retailer.home)
+            return response
+    else:
+        def fetch(timeout):
+            return get_session().get(url, headers=headers, timeout=timeout)
+    return hedged_get(retailer, fetch, deadline, prepare)
 
-def scrape_bic_camera(url):
-    """ 爬取 Bic Camera 商品資訊 """
+def scrape_product(retailer, config, url, deadline=None, headers=HEADERS):
+    """ 依 retailers.toml 的設定爬取商品資訊 (retailer 需取自同一份 config，避免混用重新載入前後的設定) """
     try:
-        scraper = cloudscraper.create_scraper(browser={'browser': 'chrome', 'platform': 'windows', 'mobile': False})
-        session = requests.Session()
-
-        # 先訪問首頁，取得 Cookies
-        session.get("https://www.biccamera.com/", headers=HEADERS, timeout=10)
-
-        # 發送請求
-        response = scraper.get(url, headers=HEADERS, timeout=30)
+        response = fetch_page(retailer, url, deadline, headers)
 
+        # 如果狀態碼不是 200，則返回錯誤
         if response.status_code != 200:
-            return {"錯誤": f"Bic Camera 請求失敗，狀態碼: {response.status_code}"}
+            return {"錯誤": f"{retailer.label} 請求失敗，狀態碼: {response.status_code}"}
 
         soup = BeautifulSoup(response.text, "lxml")
 
         # 商品名稱
-        title = soup.select_one("h1")
-        title_text = title.text.strip() if title else "無法獲取商品名稱"
+        title_text = select_text(soup, retailer.title) or retailer.title_default
 
-        # 價格
-        price_meta = soup.select_one('meta[itemprop="price"]')
-        price_jpy = clean_price(price_meta["content"]) if price_meta else None
-
-        # 圖片
-        image = soup.select_one("meta[property='og:image']")
-        image_url = image["content"] if image else ""
+        # 價格：設定的選擇器找不到時，再看 meta / JSON-LD
+        price_text = select_text(soup, retailer.price)
+        if price_text and retailer.price_strip:
+            price_text = retailer.price_strip.sub("", price_text)
+        price_jpy = (clean_price(price_text) if price_text else None) or fallback_price(soup)
 
         if title_text and price_jpy:
-            return {
-                "網站": "Bic Camera",
+            result = {
+                "網站": retailer.name,
                 "名稱": title_text,
                 "日幣價格": price_jpy,
-                "台幣報價": math.ceil(price_jpy * 0.35),
-                "圖片": image_url,
-                "連結": url
+                "台幣報價": math.ceil(price_jpy * config.twd_rate),
             }
-        return {"錯誤": "無法獲取 Bic Camera 商品價格"}
+            for field, selectors in retailer.extra.items():
+                result[field] = select_text(soup, selectors) or "無法取得"
+            result["圖片"] = select_image(soup, retailer.image)
+            result["連結"] = url
+            return result
+        return {"錯誤": f"無法獲取 {retailer.label} 商品價格"}
     except Exception as e:
-        return {"錯誤": f"Bic Camera 爬取失敗: {str(e)}"}
+        return {"錯誤": f"{retailer.label} 爬取失敗: {str(e)}"}
 
+def scrape_site(key, url, deadline=None, headers=HEADERS):
+    """ 依零售商代號爬取商品資訊，設定中沒有該零售商 (例如重新載入後被移除) 時回傳錯誤 """
+    config = get_config()
+    retailer = config.retailers.get(key)
+    if retailer is None:
+        return {"錯誤": "目前不支援此網站"}
+    return scrape_product(retailer, config, url, deadline, headers)
 
-### **新增 Matsukiyo Cocokara**
-def scrape_matsukiyo(url):
-    """ 爬取 Matsukiyo Cocokara（松本清）商品資訊 """
-    try:
-        # 使用 cloudscraper 繞過防爬
-        scraper = cloudscraper.create_scraper(browser={'browser': 'chrome', 'platform': 'windows', 'mobile': False})
-        scraper.get("https://www.matsukiyococokara-online.com/", headers=HEADERS)  # 先訪問首頁取得 cookies
-        response = scraper.get(url, headers=HEADERS, timeout=30, allow_redirects=True)
+def scrape_amazon_japan(url, deadline=None, headers=HEADERS):
+    """ 爬取 Amazon Japan 商品資訊 """
+    return scrape_site("amazon", url, deadline, headers)
 
-        # 如果狀態碼不是 200，則返回錯誤
-        if response.status_code != 200:
-            return {"錯誤": f"Matsukiyo 請求失敗，狀態碼: {response.status_code}"}
+def scrape_rakuten(url, deadline=None, headers=HEADERS):
+    """ 爬取 Rakuten 樂天市場 商品資訊 """
+    return scrape_site("rakuten", url, deadline, headers)
 
-        soup = BeautifulSoup(response.text, "lxml")
+def scrape_yahoo_auction(url, deadline=None, headers=HEADERS):
+    """ 爬取 Yahoo Auctions 商品資訊 """
+    return scrape_site("yahoo", url, deadline, headers)
 
-        # 商品名稱
-        title = soup.select_one("h1")
-        title_text = title.text.strip() if title else "無法獲取商品名稱"
+def scrape_bic_camera(url, deadline=None, headers=HEADERS):
+    """ 爬取 Bic Camera 商品資訊 """
+    return scrape_site("biccamera", url, deadline, headers)
 
-        # 嘗試從 <div class='p-productdetail__price'> 取得價格
-        price_meta = soup.select_one("div.p-productdetail__price big")
-        price_jpy = clean_price(price_meta.text) if price_meta else None
+def scrape_matsukiyo(url, deadline=None, headers=HEADERS):
+    """ 爬取 Matsukiyo Cocokara（松本清）商品資訊 """
+    return scrape_site("matsukiyo", url, deadline, headers)
+
+def get_quotation(url, deadline=DEFAULT_DEADLINE):
+    """ 根據提供的網址，依 retailers.toml 的網域對照表選擇對應的爬蟲
+
+    deadline 為這筆報價的總時限 (秒，None 表示不限)。時限內依序嘗試：
+    原始頁面 (超過 p95 會送出備援請求) → 輕量行動版頁面 → 快取快照，
+    回傳最佳結果並以「資料新鮮度」標示是即時或快取資料。
+    """
+    # 整筆報價只取一次設定，途中重新載入也不會找不到零售商
+    config = get_config()
+    retailer = config.retailer_for(url)
+    if retailer is None:
+        return {"錯誤": "目前不支援此網站"}
 
-        # 圖片
-        image = soup.select_one("meta[property='og:image']")
-        image_url = image["content"] if image else ""
+    end = time.monotonic() + deadline if deadline is not None else None
 
-        if title_text and price_jpy:
-            return {
-                "網站": "Matsukiyo Cocokara",
-                "名稱": title_text,
-                "日幣價格": price_jpy,
-                "台幣報價": math.ceil(price_jpy * 0.35),
-                "圖片": image_url,
-                "連結": url
-            }
-        return {"錯誤": "無法獲取 Matsukiyo 商品價格"}
-    except Exception as e:
-        return {"錯誤": f"Matsukiyo 爬取失敗: {str(e)}"}
-
-def get_quotation(url):
-    """ 根據提供的網址，選擇對應的爬蟲 """
-    if "amazon.co.jp" in url:
-        return scrape_amazon_japan(url)
-    elif "rakuten.co.jp" in url:
-        return scrape_rakuten(url)
-    elif "auctions.yahoo.co.jp" in url:
-        return scrape_yahoo_auction(url)
-    elif "biccamera.com" in url:
-        return scrape_bic_camera(url)
-    elif "matsukiyococokara-online.com" in url:
-        return scrape_matsukiyo(url)
-    else:
-        return {"錯誤": "目前不支援此網站"}
+    result = scrape_product(retailer, config, url, end)
+    if "錯誤" not in result:
+        return save_snapshot(url, result)
+
+    # **原始頁面失敗，時限內改抓輕量版頁面**
+    light_url = light_variant(retailer, url)
+    if light_url and time_left(end) != 0:
+        light_result = scrape_product(retailer, config, light_url, end, MOBILE_HEADERS)
+        if "錯誤" not in light_result:
+            light_result["連結"] = url
+            return save_snapshot(url, light_result)
+
+    # **最後使用快取快照**
+    return load_snapshot(url) or result
 
 if __name__ == "__main__":
     url = input("🔍 請輸入商品網址：")
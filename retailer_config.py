@@ -0,0 +1,134 @@
+import os
+import re
+import threading
+import time
+import tomllib
+from urllib.parse import urlsplit
+
+import soupsieve
+
+# **零售商設定：讀取 retailers.toml 並編譯成執行時使用的結構**
+#
+# 編譯後的設定不會再被修改，重新載入時整份換成新物件 (單一參照指派，對執行緒而言是原子操作)。
+# 每次爬取 / 解析只取一次 get_config()，就不會混用新舊設定。
+
+CONFIG_PATH = os.getenv("RETAILER_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "retailers.toml"))
+# 每隔幾秒檢查一次設定檔是否有修改
+RELOAD_INTERVAL = 2
+
+_config = None
+_config_mtime = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+class Retailer:
+    """ 單一零售商編譯後的設定 """
+
+    def __init__(self, key, data):
+        self.key = key
+        self.name = data["name"]
+        self.label = data.get("label", self.name)
+        self.hosts = tuple(host.lower() for host in data["hosts"])
+        self.fetcher = data.get("fetcher", "session")
+        self.home = data.get("home")
+        self.p95 = float(data.get("p95", 3.0))
+        self.timeout = float(data.get("timeout", 30))
+        self.title = compile_selectors(data.get("title", []))
+        self.title_default = data.get("title_default")
+        self.price = compile_selectors(data.get("price", []))
+        self.price_strip = re.compile(data["price_strip"]) if "price_strip" in data else None
+        self.image = compile_selectors(data.get("image", []))
+        self.extra = {field: compile_selectors(selectors) for field, selectors in data.get("extra", {}).items()}
+        self.light_pattern = re.compile(data["light_pattern"]) if "light_pattern" in data else None
+        self.light_url = data.get("light_url")
+
+        if self.fetcher not in ("session", "cloudscraper"):
+            raise ValueError(f"{key}: 不支援的 fetcher {self.fetcher}")
+        if self.fetcher == "cloudscraper" and not self.home:
+            raise ValueError(f"{key}: cloudscraper 需要設定 home")
+        if (self.light_pattern is None) != (self.light_url is None):
+            raise ValueError(f"{key}: light_pattern 與 light_url 需要一起設定")
+
+
+class RetailerConfig:
+    """ 整份編譯後的設定：網域對照表、OCR 規則與匯率 """
+
+    def __init__(self, data):
+        self.twd_rate = float(data["twd_rate"])
+        self.retailers = {key: Retailer(key, value) for key, value in data.get("retailers", {}).items()}
+        self.hosts = {}
+        for retailer in self.retailers.values():
+            for host in retailer.hosts:
+                self.hosts[host] = retailer
+
+        ocr = data.get("ocr", {})
+        self.name_exclude = re.compile(ocr.get("name_exclude", "(?!)"))
+        self.name_exclude_substrings = tuple(ocr.get("name_exclude_substrings", ()))
+        self.ocr_markers = {site: tuple(marker.lower() for marker in markers)
+                            for site, markers in ocr.get("markers", {}).items()}
+
+    def retailer_for(self, url):
+        """ 依網址的網域 (含子網域) 找出對應的零售商，找不到 (或網址格式錯誤) 回傳 None """
+        try:
+            host = urlsplit(url if "//" in url else f"//{url}").hostname or ""
+        except ValueError:  # 例如 http://[abc/x
+            return None
+        labels = host.split(".")
+        for i in range(len(labels)):
+            retailer = self.hosts.get(".".join(labels[i:]))
+            if retailer:
+                return retailer
+        return None
+
+    def is_ocr_site(self, site, text):
+        """ OCR 文字中是否出現該網站的識別字 """
+        lowered = text.lower()
+        return any(marker in lowered for marker in self.ocr_markers.get(site, ()))
+
+    def is_product_name(self, line):
+        """ OCR 的這一行是否可能是商品名稱 """
+        return (len(line) > 5 and not self.name_exclude.search(line)
+                and not any(substring in line for substring in self.name_exclude_substrings))
+
+
+def compile_selectors(selectors):
+    """ 將 CSS 選擇器字串預先編譯 """
+    return tuple(soupsieve.compile(selector) for selector in selectors)
+
+
+def load_config(path=CONFIG_PATH):
+    """ 讀取並編譯設定檔，格式錯誤時拋出例外 """
+    with open(path, "rb") as f:
+        return RetailerConfig(tomllib.load(f))
+
+
+def get_config():
+    """ 取得目前的設定，設定檔修改後自動重新編譯
+
+    第一次呼叫時載入 (設定有誤直接拋出例外)；之後重新載入失敗則印出警告並沿用舊設定。
+    """
+    global _config, _config_mtime, _checked_at
+    now = time.monotonic()
+    if _config is not None and now - _checked_at < RELOAD_INTERVAL:
+        return _config
+
+    with _lock:
+        if _config is not None and now - _checked_at < RELOAD_INTERVAL:
+            return _config
+        _checked_at = now
+        try:
+            mtime = os.stat(CONFIG_PATH).st_mtime_ns
+        except OSError:
+            if _config is None:
+                raise
+            return _config
+        if mtime != _config_mtime:
+            try:
+                _config = load_config(CONFIG_PATH)
+            except Exception as e:
+                if _config is None:
+                    raise
+                print(f"⚠️ 零售商設定重新載入失敗，沿用舊設定: {e}")
+            _config_mtime = mtime
+    return _config
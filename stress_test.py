@@ -0,0 +1,147 @@
+"""
+併發正確性壓力測試：大量執行緒 (或 greenlet) 同時呼叫報價爬蟲與 /upload，
+確認每個結果都和單執行緒時一致，才能放心調高每個 worker 的併發數。
+
+使用 load_test.py 的假零售網站與假 Vision OCR 服務；HTTP / HTTPS proxy 都指向假零售網站，
+有請求沒被假服務處理 (例如改連 https 的真實網站) 時測試即失敗。
+報價網址也包含使用 cloudscraper 的網站 (load_test.harness_config 將其首頁改為 http://)。
+
+用法：
+    python stress_test.py                       # 64 個執行緒，每個 10 次
+    python stress_test.py --threads 200 --calls 20
+    python stress_test.py --gevent              # gevent monkey patch 後以 greenlet 執行 (需另外安裝 gevent)
+"""
+import sys
+
+if __name__ == "__main__" and "--gevent" in sys.argv:
+    from gevent import monkey
+    monkey.patch_all()
+
+import argparse
+import contextlib
+import io
+import math
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+
+import load_test
+
+
+def fake_ocr_text(content):
+    """ 依圖片內容產生 OCR 文字，讓每張圖片都有不同的預期結果 """
+    number = int(re.search(rb"\d+", content).group())
+    return f"ストレステスト商品 {number} 番\n¥{1000 + number:,} (税込)\nカートに入れる"
+
+
+def expected_upload(number, twd_rate):
+    """ fake_ocr_text 對應的 /upload 預期結果 """
+    price_jpy = 1000 + number
+    return {
+        "status": "done",
+        "商品名稱": f"ストレステスト商品 {number} 番",
+        "商品日幣價格 (含稅)": f"{price_jpy} 円",
+        "台幣報價": f"{math.ceil(price_jpy * twd_rate)} 元",
+        "含稅": True,
+        "解析來源": "regex",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="報價 / OCR 併發正確性測試")
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--calls", type=int, default=10, help="每個執行緒呼叫的次數")
+    parser.add_argument("--latency", type=float, default=0.05, help="假服務平均回應時間 (秒)")
+    parser.add_argument("--gevent", action="store_true", help="以 gevent greenlet 執行")
+    args = parser.parse_args()
+
+    retailer = load_test.start_mock_server(load_test.make_retailer_handler(
+        load_test.MockBehaviour(args.latency, args.latency / 2)))
+    vision_api = load_test.start_mock_server(load_test.make_vision_handler(
+        load_test.MockBehaviour(args.latency, args.latency / 2), fake_ocr_text))
+
+    tmp = tempfile.mkdtemp()
+    os.environ.update({
+        "HTTP_PROXY": f"http://127.0.0.1:{retailer.server_port}",
+        "http_proxy": f"http://127.0.0.1:{retailer.server_port}",
+        "HTTPS_PROXY": f"http://127.0.0.1:{retailer.server_port}",
+        "https_proxy": f"http://127.0.0.1:{retailer.server_port}",
+        "NO_PROXY": "127.0.0.1,localhost",
+        "no_proxy": "127.0.0.1,localhost",
+        "VISION_API_ENDPOINT": f"127.0.0.1:{vision_api.server_port}",
+        "GOOGLE_CREDENTIALS_PATH": os.path.join(tmp, "google_api.json"),
+        "RETAILER_CONFIG": load_test.harness_config(os.path.join(tmp, "retailers.toml")),
+    })
+    os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", "{}")
+
+    from app import app
+    from quote_scraper import get_quotation
+    from retailer_config import get_config
+
+    twd_rate = get_config().twd_rate
+
+    # **單執行緒的基準結果**
+    baseline = {}
+    for url in load_test.QUOTE_URLS:
+        result = get_quotation(url, deadline=None)
+        if "錯誤" in result:
+            sys.exit(f"❌ 基準報價失敗：{url} {result}")
+        baseline[url] = (result["名稱"], result["日幣價格"])
+
+    failures = []
+    lock = threading.Lock()
+    counts = {"quote": 0, "upload": 0, "cached": 0}
+
+    def fail(message):
+        with lock:
+            failures.append(message)
+
+    def worker(index):
+        client = app.test_client()
+        for call in range(args.calls):
+            if random.random() < 0.5:
+                url = random.choice(load_test.QUOTE_URLS)
+                result = get_quotation(url, deadline=None)
+                if (result.get("名稱"), result.get("日幣價格")) != baseline[url]:
+                    fail(f"報價結果不一致：{url} {result}")
+                elif result.get("資料新鮮度") == "快取":
+                    # 逾時改用快照時資料仍須正確，只另外計數
+                    with lock:
+                        counts["cached"] += 1
+                kind = "quote"
+            else:
+                number = index * args.calls + call
+                response = client.post("/upload", data={"file": (io.BytesIO(f"image-{number}".encode()), "item.png")},
+                                       content_type="multipart/form-data")
+                result = response.get_json()
+                result.pop("ocr_text", None)
+                if result != expected_upload(number, twd_rate):
+                    fail(f"OCR 結果不一致：#{number} {result}")
+                kind = "upload"
+            with lock:
+                counts[kind] += 1
+
+    print(f"🚀 {args.threads} 個{'greenlet' if args.gevent else '執行緒'}，每個呼叫 {args.calls} 次 ...")
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    with contextlib.redirect_stdout(io.StringIO()):  # 略過 /upload 印出的 OCR 文字
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.monotonic() - started
+
+    print(f"📌 報價 {counts['quote']} 次 (其中 {counts['cached']} 次為快取)、OCR {counts['upload']} 次，耗時 {elapsed:.1f} 秒")
+    if failures or counts["quote"] + counts["upload"] != args.threads * args.calls:
+        for message in failures[:10]:
+            print(f"❌ {message}")
+        sys.exit(f"❌ 共 {len(failures)} 筆結果不正確")
+    load_test.check_unexpected(retailer)
+    print("✅ 所有結果皆正確")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+OCR 文字抽取 (正規表示式 + LLM) 的測試，以假的 OpenAI client 取代真正的 API
+
+用法：
+    python -m pytest -q test_llm_extractor.py
+"""
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import llm_extractor
+
+
+class FakeCompletions:
+    """ 依模型名稱回傳預先設定的內容，值為例外時改為拋出 """
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.models = []
+
+    def create(self, model, messages, **kwargs):
+        self.models.append(model)
+        reply = self.replies[model]
+        if isinstance(reply, Exception):
+            raise reply
+        content = reply if isinstance(reply, str) else json.dumps(reply)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def make_backend(replies):
+    # 不經過 __init__，測試時不需要 openai 套件與 API Key
+    backend = llm_extractor.OpenAIBackend.__new__(llm_extractor.OpenAIBackend)
+    backend.cheap_model, backend.strong_model = "cheap", "strong"
+    backend.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(replies)))
+    return backend
+
+
+CHEAP_REPLY = {"items": [
+    {"index": 0, "name": "商品A", "price_jpy": 1290, "tax_included": True},
+    {"index": 1, "name": None, "price_jpy": 500, "tax_included": None},
+]}
+
+
+@pytest.mark.parametrize("strong_reply", [RuntimeError("rate limited"), "not json", {"items": "oops"}])
+def test_strong_model_failure_keeps_cheap_results(strong_reply):
+    """ 較強的模型失敗或回傳格式錯誤時，保留便宜模型的結果 """
+    backend = make_backend({"cheap": CHEAP_REPLY, "strong": strong_reply})
+    results = backend.extract_batch(["a", "b"])
+    assert backend.client.chat.completions.models == ["cheap", "strong"]
+    assert results == [
+        {"name": "商品A", "price_jpy": 1290, "tax_included": True},
+        {"name": None, "price_jpy": 500, "tax_included": None},
+    ]
+
+
+def test_stub_results_are_tagged_and_not_cached():
+    """ 本機替身的結果標示為 stub，且不寫入快取 """
+    text = "ストレステスト専用 スタブ商品\n¥1,234"
+    first, = llm_extractor.extract_products([text], backend=llm_extractor.StubBackend())
+    second, = llm_extractor.extract_products([text], backend=llm_extractor.StubBackend())
+    assert first == second == {"name": "ストレステスト専用 スタブ商品", "price_jpy": 1234, "tax_included": None,
+                               "source": "stub"}
+
+
+def test_default_stub_skips_micro_batcher(monkeypatch):
+    """ 沒有 API Key (預設替身) 時不經過 micro-batcher，直接標示正規表示式結果 """
+    batcher = llm_extractor.MicroBatcher(llm_extractor.StubBackend())
+    monkeypatch.setattr(batcher, "submit", lambda text: pytest.fail("不應使用 micro-batcher"))
+    monkeypatch.setattr(llm_extractor, "_batcher", batcher)
+    result, = llm_extractor.extract_products(["スタブ直通商品\n¥2,000"])
+    assert result == {"name": "スタブ直通商品", "price_jpy": 2000, "tax_included": None, "source": "stub"}
+
+
+def test_backend_interface_is_abstract():
+    with pytest.raises(TypeError):
+        llm_extractor.LLMBackend()
+
+
+class RecordingBackend(llm_extractor.LLMBackend):
+    """ 記錄每次 extract_batch 收到的文字，名稱以文字第一行回傳 """
+    cache_results = False
+
+    def __init__(self):
+        self.batches = []
+
+    def extract_batch(self, texts):
+        self.batches.append(list(texts))
+        return [{"name": text.splitlines()[0], "price_jpy": 100, "tax_included": True} for text in texts]
+
+
+def test_concurrent_requests_share_one_llm_call(monkeypatch):
+    """ 同一時間窗內多個請求的低信心文字合併成一次 LLM 呼叫，各自拿回自己的結果 """
+    backend = RecordingBackend()
+    monkeypatch.setattr(llm_extractor, "_batcher", llm_extractor.MicroBatcher(backend, window=0.2))
+    texts = [f"マイクロバッチ商品 {n}\n¥{n}" for n in range(5)]
+    results = {}
+
+    def request(text):
+        results[text] = llm_extractor.extract_products([text])[0]
+
+    threads = [threading.Thread(target=request, args=(text,)) for text in texts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(backend.batches) == 1
+    assert sorted(backend.batches[0]) == sorted(texts)
+    assert {text: result["name"] for text, result in results.items()} == {text: text.splitlines()[0] for text in texts}
+
+
+def test_full_batch_is_sent_without_waiting():
+    """ 湊滿 size 段時立即呼叫，不等時間窗 """
+    backend = RecordingBackend()
+    batcher = llm_extractor.MicroBatcher(backend, window=60, size=2)
+    first, second = batcher.submit("商品 A"), batcher.submit("商品 B")
+    assert first.result(timeout=1)["name"] == "商品 A"
+    assert second.result(timeout=1)["name"] == "商品 B"
+    assert backend.batches == [["商品 A", "商品 B"]]
+
+
+class StuckBackend(RecordingBackend):
+    """ 呼叫一直卡住，直到測試放行 """
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def extract_batch(self, texts):
+        self.release.wait(5)
+        return super().extract_batch(texts)
+
+
+@pytest.mark.parametrize("size", [1, 8])
+def test_stuck_llm_falls_back_to_regex(monkeypatch, size):
+    """ LLM 超過 LLM_WAIT 秒未回應時使用正規表示式的結果 (湊滿一批時送出的請求也不會被卡住) """
+    backend = StuckBackend()
+    monkeypatch.setattr(llm_extractor, "_batcher", llm_extractor.MicroBatcher(backend, window=0.01, size=size))
+    monkeypatch.setattr(llm_extractor, "LLM_WAIT", 0.2)
+    started = time.monotonic()
+    result, = llm_extractor.extract_products([f"タイムアウト商品 {size}\n¥980"])
+    backend.release.set()
+    assert time.monotonic() - started < 1
+    assert result == {"name": f"タイムアウト商品 {size}", "price_jpy": 980, "tax_included": None, "source": "regex"}
+
+
+def test_strong_model_fills_incomplete_items():
+    """ 便宜模型抽不完整的項目交給較強的模型 """
+    strong_reply = {"items": [{"index": 0, "name": "商品B", "price_jpy": 550, "tax_included": True}]}
+    backend = make_backend({"cheap": CHEAP_REPLY, "strong": strong_reply})
+    results = backend.extract_batch(["a", "b"])
+    assert results[1] == {"name": "商品B", "price_jpy": 550, "tax_included": True}
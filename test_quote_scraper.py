@@ -0,0 +1,202 @@
+"""
+報價爬蟲的時限、備援請求與快照退路測試 (不連網路)
+
+用法：
+    python -m pytest -q test_quote_scraper.py
+"""
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+import quote_scraper
+from retailer_config import Retailer, RetailerConfig
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_retailer(p95, timeout=5):
+    return Retailer("hedge-test", {"name": "Hedge Test", "hosts": ["hedge.test"], "p95": p95, "timeout": timeout})
+
+
+class CountingFetch:
+    """ 依呼叫順序決定每次請求要花幾秒，並記錄實際開始了幾次請求 """
+
+    def __init__(self, *delays):
+        self.delays = delays
+        self.started = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, timeout):
+        with self.lock:
+            index = self.started
+            self.started += 1
+        time.sleep(self.delays[min(index, len(self.delays) - 1)])
+        return f"response-{index}"
+
+
+def test_hedge_wins_when_primary_is_slow():
+    """ 超過 p95 仍未回應時送出備援請求，採用先回來的結果 """
+    fetch = CountingFetch(1.0, 0.0)
+    started = time.monotonic()
+    assert quote_scraper.hedged_get(make_retailer(p95=0.1), fetch) == "response-1"
+    assert time.monotonic() - started < 0.5
+    assert fetch.started == 2
+
+
+def test_no_hedge_when_p95_exceeds_remaining():
+    """ p95 比剩餘時間長時不送備援請求，時限到就放棄 """
+    fetch = CountingFetch(1.0)
+    with pytest.raises(TimeoutError):
+        quote_scraper.hedged_get(make_retailer(p95=2.0), fetch, time.monotonic() + 0.3)
+    assert fetch.started == 1
+
+
+def test_queued_fetches_are_cancelled_after_deadline(monkeypatch):
+    """ 呼叫端逾時後，還在執行緒池排隊的請求不會再被送出 """
+    monkeypatch.setattr(quote_scraper, "_hedge_pool", ThreadPoolExecutor(max_workers=1))
+    fetch = CountingFetch(0.5)
+    retailer = make_retailer(p95=10.0)
+
+    timeouts = []
+
+    def caller():
+        try:
+            quote_scraper.hedged_get(retailer, fetch, time.monotonic() + 0.2)
+        except TimeoutError:
+            timeouts.append(True)
+
+    callers = [threading.Thread(target=caller) for _ in range(5)]
+    for thread in callers:
+        thread.start()
+    for thread in callers:
+        thread.join()
+    time.sleep(1.0)
+    assert len(timeouts) == 5
+    assert fetch.started == 1
+
+
+def test_cloudscraper_dropped_on_block_and_after_ttl(monkeypatch):
+    """ 回應非 200 或超過 SCRAPER_TTL 時重新建立 cloudscraper (重新取得 cookies) """
+    monkeypatch.setattr(quote_scraper, "_hedge_pool", ThreadPoolExecutor(max_workers=1))
+    statuses = iter([403, 200, 200, 200])
+    created = []
+
+    class FakeScraper:
+        def get(self, url, **kwargs):
+            status = 200 if url == retailer.home else next(statuses)
+            return type("Response", (), {"status_code": status})()
+
+    def create_scraper(**kwargs):
+        created.append(FakeScraper())
+        return created[-1]
+
+    monkeypatch.setattr(quote_scraper.cloudscraper, "create_scraper", create_scraper)
+    retailer = Retailer("scraper-test", {"name": "Scraper Test", "hosts": ["scraper.test"], "fetcher": "cloudscraper",
+                                         "home": "http://scraper.test/", "p95": 10})
+
+    def fetch_status():
+        return quote_scraper.fetch_page(retailer, "http://scraper.test/item", None, quote_scraper.HEADERS).status_code
+
+    assert fetch_status() == 403
+    assert fetch_status() == 200
+    assert fetch_status() == 200
+    assert len(created) == 2
+
+    monkeypatch.setattr(quote_scraper, "SCRAPER_TTL", 0)
+    assert fetch_status() == 200
+    assert len(created) == 3
+
+
+def test_cloudscraper_warm_up_not_counted_in_latency(monkeypatch):
+    """ cloudscraper 訪問首頁的時間不計入網站回應時間 (p95) """
+    monkeypatch.setattr(quote_scraper, "_hedge_pool", ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(quote_scraper, "_latencies", {})
+    retailer = Retailer("warm-up-test", {"name": "Warm Up Test", "hosts": ["warm-up.test"], "fetcher": "cloudscraper",
+                                         "home": "http://warm-up.test/", "p95": 10})
+
+    class SlowHomeScraper:
+        def get(self, url, **kwargs):
+            if url == retailer.home:
+                time.sleep(0.5)
+            return type("Response", (), {"status_code": 200})()
+
+    monkeypatch.setattr(quote_scraper.cloudscraper, "create_scraper", lambda **kwargs: SlowHomeScraper())
+    quote_scraper.fetch_page(retailer, "http://warm-up.test/item", None, quote_scraper.HEADERS)
+    samples = list(quote_scraper._latencies["warm-up-test"])
+    assert len(samples) == 1 and samples[0] < 0.1
+
+
+@pytest.mark.parametrize("key, filename, name, price_jpy", [
+    ("amazon", "amazon_debug.html", "香源 松栄堂の防虫香 上品 防虫香 10袋入 #520138", 1638),
+    ("rakuten", "rakuten_debug.html",
+     "【楽天市場】●【楽天倉庫発送◇全国送料無料】正規品【箱付き】 シーバスリーガル ミズナラ 12年 40度 700ml "
+     "【ウイスキー】：リカーズ\u3000スリーライン", 4516),
+    ("yahoo", "yahoo_debug.html",
+     "トラック用 アシストグリップ スマートフォンホルダー アシストグリップ固定式\u3000乗降補助グリップにガッチリ固定", 3100),
+], ids=["amazon", "rakuten", "yahoo"])
+def test_scrape_product_on_saved_pages(monkeypatch, key, filename, name, price_jpy):
+    """ 以存檔的商品頁面確認 retailers.toml 的選擇器抽出的名稱與價格 """
+    with open(os.path.join(BASE_DIR, filename), encoding="utf-8") as f:
+        html = f.read()
+    monkeypatch.setattr(quote_scraper, "fetch_page", lambda *args: SimpleNamespace(status_code=200, text=html))
+    config = quote_scraper.get_config()
+    result = quote_scraper.scrape_product(config.retailers[key], config, "https://example.test/item")
+    assert (result["名稱"], result["日幣價格"]) == (name, price_jpy)
+    assert result["台幣報價"] == math.ceil(price_jpy * config.twd_rate)
+
+
+def test_zero_deadline_is_not_unlimited():
+    """ deadline=0 代表已經沒有時間，而不是不限時 """
+    result = quote_scraper.get_quotation("https://www.amazon.co.jp/dp/B0000ZERO0", deadline=0)
+    assert "時限" in result["錯誤"]
+
+
+def test_config_reload_during_quote(monkeypatch):
+    """ 報價途中設定重新載入 (零售商被移除) 時，仍用同一份設定完成這筆報價 """
+    configs = iter([quote_scraper.get_config(), RetailerConfig({"twd_rate": 0.3})])
+    monkeypatch.setattr(quote_scraper, "get_config", lambda: next(configs))
+    result = quote_scraper.get_quotation("https://www.amazon.co.jp/dp/B000RELOAD", deadline=0)
+    assert result["錯誤"].startswith("Amazon 爬取失敗")
+
+
+def test_light_page_keeps_scheme():
+    """ 輕量版頁面沿用原網址的 scheme，http 網址不會改連 https """
+    amazon = quote_scraper.get_config().retailers["amazon"]
+    assert quote_scraper.light_variant(amazon, "http://www.amazon.co.jp/dp/B000000000") == \
+        "http://www.amazon.co.jp/gp/aw/d/B000000000"
+    assert quote_scraper.light_variant(amazon, "https://www.amazon.co.jp/dp/B000000000") == \
+        "https://www.amazon.co.jp/gp/aw/d/B000000000"
+
+
+def test_light_page_then_snapshot(monkeypatch):
+    """ 原始頁面失敗改用輕量版頁面；兩者都失敗時回傳快照並標記為快取 """
+    url = "https://www.amazon.co.jp/dp/B0000LIGHT"
+    calls = []
+    light_ok = True
+
+    def fake_scrape(retailer, config, page_url, deadline=None, headers=quote_scraper.HEADERS):
+        calls.append((page_url, headers))
+        if page_url != url and light_ok:
+            return {"網站": "Amazon Japan", "名稱": "輕量版商品", "日幣價格": 1000, "連結": page_url}
+        return {"錯誤": "Amazon 爬取失敗: 已超過報價時限"}
+
+    monkeypatch.setattr(quote_scraper, "scrape_product", fake_scrape)
+
+    result = quote_scraper.get_quotation(url)
+    assert calls == [(url, quote_scraper.HEADERS),
+                     ("https://www.amazon.co.jp/gp/aw/d/B0000LIGHT", quote_scraper.MOBILE_HEADERS)]
+    assert result["名稱"] == "輕量版商品"
+    assert result["連結"] == url
+    assert result["資料新鮮度"] == "即時"
+
+    light_ok = False
+    result = quote_scraper.get_quotation(url)
+    assert result["名稱"] == "輕量版商品"
+    assert result["資料新鮮度"] == "快取"
+    assert result["快取秒數"] >= 0
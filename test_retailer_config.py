@@ -0,0 +1,90 @@
+"""
+零售商設定 (retailers.toml) 的網域對照與重新載入測試
+
+用法：
+    python -m pytest -q test_retailer_config.py
+"""
+import itertools
+import os
+import time
+
+import pytest
+
+import retailer_config
+
+
+@pytest.mark.parametrize("url, key", [
+    ("https://item.rakuten.co.jp/3line/f000000027/", "rakuten"),
+    ("https://www.amazon.co.jp/dp/B000000000", "amazon"),
+    ("amazon.co.jp/dp/B000000000", "amazon"),
+    ("https://page.auctions.yahoo.co.jp/jp/auction/x000000000", "yahoo"),
+    ("https://amazon.co.jp.evil.com/dp/B000000000", None),
+    ("https://evil.com/?x=amazon.co.jp", None),
+    ("https://notamazon.co.jp/dp/B000000000", None),
+    ("https://shopping.yahoo.co.jp/item", None),
+])
+def test_retailer_for_matches_host_suffix(url, key):
+    """ 只比對網址的網域 (含子網域)，不看路徑或查詢字串 """
+    retailer = retailer_config.load_config().retailer_for(url)
+    assert (retailer.key if retailer else None) == key
+
+
+@pytest.mark.parametrize("url", ["http://[abc/x", "https://[::1/item", "http://]/"])
+def test_malformed_url_is_unsupported(url):
+    """ 格式錯誤的網址視為不支援的網站，不拋出例外 """
+    assert retailer_config.load_config().retailer_for(url) is None
+
+
+@pytest.mark.parametrize("light", [{"light_pattern": "/dp/(\\w+)"}, {"light_url": "{scheme}://light.test/{0}"}])
+def test_light_pattern_requires_light_url(light):
+    """ light_pattern 與 light_url 只設定其中一個時，載入設定就失敗 """
+    with pytest.raises(ValueError, match="light_pattern"):
+        retailer_config.Retailer("light-test", dict({"name": "Light Test", "hosts": ["light.test"]}, **light))
+
+
+# 每次寫入設定檔都用不同的 mtime (有些檔案系統的時間精度很粗)
+_mtimes = itertools.count(int(time.time()), 10)
+
+
+def write_config(path, twd_rate, extra=""):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f'twd_rate = {twd_rate}\n[retailers.test]\nname = "Test"\nhosts = ["shop.test"]\n{extra}')
+    mtime = next(_mtimes)
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    """ 讓 get_config() 改讀暫存的設定檔，並清掉已載入的設定 """
+    path = tmp_path / "retailers.toml"
+    write_config(path, 0.3)
+    monkeypatch.setattr(retailer_config, "CONFIG_PATH", str(path))
+    monkeypatch.setattr(retailer_config, "RELOAD_INTERVAL", 0.2)
+    monkeypatch.setattr(retailer_config, "_config", None)
+    monkeypatch.setattr(retailer_config, "_config_mtime", None)
+    monkeypatch.setattr(retailer_config, "_checked_at", 0.0)
+    return path
+
+
+def test_get_config_reloads_after_interval(config_file):
+    """ 設定檔修改後，超過 RELOAD_INTERVAL 才重新載入 """
+    first = retailer_config.get_config()
+    assert first.twd_rate == 0.3
+
+    write_config(config_file, 0.4)
+    assert retailer_config.get_config() is first  # 還沒到檢查時間
+    time.sleep(0.25)
+    assert retailer_config.get_config().twd_rate == 0.4
+
+
+@pytest.mark.parametrize("broken", ["twd_rate = [", 'light_pattern = "/dp/(\\w+)"'], ids=["toml", "light"])
+def test_get_config_keeps_old_config_when_reload_fails(config_file, broken):
+    """ 新的設定檔有誤時沿用舊設定，修正後再重新載入 """
+    first = retailer_config.get_config()
+    write_config(config_file, 0.4, broken)
+    time.sleep(0.25)
+    assert retailer_config.get_config() is first
+
+    write_config(config_file, 0.5)
+    time.sleep(0.25)
+    assert retailer_config.get_config().twd_rate == 0.5
@@ -0,0 +1,89 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+from google.cloud import vision
+
+# **Google Cloud Vision client 共用模組，可在多執行緒 / gevent worker 中安全使用**
+#
+# gRPC client 本身是 thread-safe，整個行程共用一個；
+# 連本機假 OCR 服務時用的是 REST transport (底層為 requests.Session)，改為每個執行緒各一個。
+
+# 憑證 JSON 寫出的檔案位置 (可用 GOOGLE_CREDENTIALS_PATH 覆寫)
+DEFAULT_CRED_PATH = "/opt/render/project/.creds/google_api.json"
+
+_lock = threading.Lock()
+_client = None
+_local = threading.local()
+_credentials_ready = False
+
+
+def setup_credentials(cred_path=None):
+    """ 將環境變數中的憑證 JSON 寫成檔案並指向它，同一行程只做一次
+
+    GOOGLE_APPLICATION_CREDENTIALS 已經是存在的檔案路徑時直接使用；
+    寫檔採用暫存檔 + os.replace，多個 worker 同時啟動也不會讀到寫一半的檔案。
+    """
+    global _credentials_ready
+    with _lock:
+        if _credentials_ready:
+            return
+        cred_json = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+        if not cred_json:
+            raise ValueError("❌ 找不到 Google Cloud 憑證")
+
+        if not os.path.isfile(cred_json):
+            try:
+                json.loads(cred_json)
+            except ValueError:
+                raise ValueError("❌ GOOGLE_APPLICATION_CREDENTIALS 不是存在的檔案，也不是憑證 JSON") from None
+            cred_path = cred_path or os.getenv("GOOGLE_CREDENTIALS_PATH", DEFAULT_CRED_PATH)
+            os.makedirs(os.path.dirname(cred_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cred_path), suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                f.write(cred_json)
+            os.replace(tmp_path, cred_path)
+            os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = cred_path
+        _credentials_ready = True
+
+
+def _gevent_patched():
+    """ 是否在 gevent monkey patch 後的環境中執行 """
+    if "gevent" not in sys.modules:
+        return False
+    from gevent import monkey
+    return monkey.is_module_patched("socket")
+
+
+def create_vision_client():
+    """ 建立 Vision API client，設定 VISION_API_ENDPOINT 時改連本機的假 OCR 服務 (壓力測試用) """
+    endpoint = os.getenv("VISION_API_ENDPOINT")
+    if not endpoint:
+        return vision.ImageAnnotatorClient()
+
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud.vision_v1.services.image_annotator.transports import ImageAnnotatorRestTransport
+
+    transport = ImageAnnotatorRestTransport(host=endpoint, credentials=AnonymousCredentials(), url_scheme="http")
+    return vision.ImageAnnotatorClient(transport=transport)
+
+
+def get_vision_client():
+    """ 取得共用的 Vision API client (REST transport 則為每個執行緒各一個) """
+    global _client
+    if os.getenv("VISION_API_ENDPOINT"):
+        if getattr(_local, "client", None) is None:
+            _local.client = create_vision_client()
+        return _local.client
+
+    if _client is None:
+        setup_credentials()
+        with _lock:
+            if _client is None:
+                # gevent worker 需要先讓 gRPC 改用 gevent 的 I/O，否則會卡住整個 worker
+                if _gevent_patched():
+                    import grpc.experimental.gevent
+                    grpc.experimental.gevent.init_gevent()
+                _client = vision.ImageAnnotatorClient()
+    return _client